@@ -1,31 +1,196 @@
 import os 
+import base64
 import shutil
+import sys
 import hashlib
 import json
+import mmap
 import time
 from datetime import datetime
 import argparse
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import chain, repeat
+
+#fcntl is only on unix, it is used for reflink copies (FICLONE)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+#blake3 is optional, when it is installed it is the default hash (much faster than sha256)
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+#orjson is optional, it is only used to read/write the manifest faster
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 MANIFEST_FILE_NAME = "manifest.json"
 
-def calculate_file_hash(file_path: str, chunk_size: int = 4096) -> str:
+#hashing runs in C without the GIL and copying waits on disk, so use more threads than cores
+MAX_WORKERS = (os.cpu_count() or 1) * 2
+
+#small files (up to SMALL_FILE_THRESHOLD) are given to the workers in batches of this many per task,
+#bigger files get a task each so a folder of big files is spread over all workers
+HASH_BATCH_SIZE = 16
+
+#at most this many tasks per worker are waiting at a time, results are read while the walk goes on
+PENDING_TASKS_PER_WORKER = 4
+
+#per file messages are collected and written to stdout this many at a time
+LOG_BATCH_SIZE = 1000
+
+#linux ioctl number of FICLONE (_IOW(0x94, 9, int)), it makes a copy-on-write copy on Btrfs/XFS
+FICLONE = 0x40049409
+
+#how many manifest entries each verify worker process gets at a time
+VERIFY_CHUNK_SIZE = 16
+
+#calculate_file_hash picks how to read a file by its size:
+#  up to SMALL_FILE_THRESHOLD        -> one read and one update call
+#  bigger                            -> readinto loop with a reused 256 KiB buffer
+#  bigger than MMAP_THRESHOLD        -> memory map and one update call (verify only, use_mmap=True)
+#  BLAKE3_THREADS_THRESHOLD and more -> also multi-threaded blake3 when that is the algorithm
+SMALL_FILE_THRESHOLD = 64 * 1024
+MMAP_THRESHOLD = 4 * 1024 * 1024
+BLAKE3_THREADS_THRESHOLD = 16 * 1024 * 1024
+
+#every thread keeps its own read buffer so small files do not allocate a new one per call
+_thread_buffers = threading.local()
+
+def _get_read_buffer(chunk_size: int) -> tuple:
+    """
+    It returns (buffer, memoryview) of the given size for the current thread.
+    The same buffer is returned again on the next call from this thread.
+    """
+    if getattr(_thread_buffers, "size", None) != chunk_size:
+        _thread_buffers.buf = bytearray(chunk_size)
+        _thread_buffers.view = memoryview(_thread_buffers.buf)
+        _thread_buffers.size = chunk_size
+    return _thread_buffers.buf, _thread_buffers.view
+
+#hash algorithm name (stored as "hash_algo" in the manifest) -> function that makes a new hasher
+#hashlib.sha256 is already OpenSSL's sha256, which uses the SHA-NI instructions when the CPU has them
+HASHER_FACTORIES = {"sha256": hashlib.sha256}
+if blake3 is not None:
+    HASHER_FACTORIES["blake3"] = blake3.blake3
+
+#algorithm for new manifest entries. entries without "hash_algo" are from old manifests and use sha256
+DEFAULT_HASH_ALGO = "blake3" if blake3 is not None else "sha256"
+LEGACY_HASH_ALGO = "sha256"
+
+def encode_hash(digest: bytes) -> str:
+    """
+    It converts a raw digest to the text stored in the manifest (base64, 44 chars instead of 64 hex chars).
+    """
+    return base64.b64encode(digest).decode("ascii")
+
+def decode_hash(stored_hash: str) -> bytes:
+    """
+    It converts a manifest hash back to the raw digest.
+    Old manifests stored 64 char hex strings, those are still understood.
+    """
+    if len(stored_hash) == 64:
+        return bytes.fromhex(stored_hash)
+    return base64.b64decode(stored_hash)
+
+#posix_fadvise is not available on windows and macOS
+HAS_FADVISE = hasattr(os, "posix_fadvise")
+
+def drop_page_cache(file_path: str) -> None:
+    """
+    It tells the kernel that the cached pages of the file are not needed anymore.
+    It does nothing where posix_fadvise is not available.
+    """
+    if not HAS_FADVISE:
+        return
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+def calculate_file_hash(file_path: str, chunk_size: int = 256 * 1024, algo: str = DEFAULT_HASH_ALGO, drop_cache: bool = True, use_mmap: bool = False) -> bytes:
     """
     This function is used to calculate the hash of a file.
-    It read data in given chunk size. if data not found to read it will break the loop.
+    It returns the raw digest bytes, use encode_hash to store it in the manifest.
+    See calculate_file_hash_and_stat for how the file is read.
+    """
+    return calculate_file_hash_and_stat(file_path, chunk_size, algo, drop_cache, use_mmap)[0]
+
+def calculate_file_hash_and_stat(file_path: str, chunk_size: int = 256 * 1024, algo: str = DEFAULT_HASH_ALGO, drop_cache: bool = True, use_mmap: bool = False) -> tuple:
+    """
+    It returns (digest, stat) of a file. stat is taken from the open file after it was read,
+    so size and mtime describe the content that was hashed even if the file changed since it was listed.
+    algo is a key of HASHER_FACTORIES, it raises ValueError if that algorithm is not available.
+    The file is opened without python buffering and read in a way that fits its size:
+        Small files (up to SMALL_FILE_THRESHOLD) are read with one call and hashed with one update.
+        Bigger files are read in given chunk size (256 KiB by default) into one buffer per thread,
+        which is reused for every chunk and every file. if data not found to read it will break the loop.
+        If use_mmap is True, files bigger than MMAP_THRESHOLD are memory mapped and hashed in one call,
+        the kernel does the readahead. Only use it for files nothing else is writing to (the verify path reads
+        backup files): if a mapped file shrinks while it is hashed the whole process is killed (SIGBUS).
+        Files of BLAKE3_THREADS_THRESHOLD or more use all cores when the algorithm is blake3.
+    The kernel is told bigger files are read sequentially, and if drop_cache is True the file pages are
+    dropped from the page cache after hashing so a big backup does not push other data out of memory.
     If file not exists it stop the function.
     """
-    sha256 = hashlib.sha256()
-    with open(file_path, "rb") as f:
-        while True:
-            data = f.read(chunk_size)
-            if not data:
-                break
-            sha256.update(data)
-    return sha256.hexdigest()
+    if algo not in HASHER_FACTORIES:
+        raise ValueError(f"Unsupported hash algorithm: {algo}")
+    
+    with open(file_path, "rb", buffering=0) as f:
+        fd = f.fileno()
+        size = os.fstat(fd).st_size
+        
+        if algo == "blake3" and size >= BLAKE3_THREADS_THRESHOLD:
+            hasher = blake3.blake3(max_threads=blake3.blake3.AUTO)
+        else:
+            hasher = HASHER_FACTORIES[algo]()
+        
+        if size <= SMALL_FILE_THRESHOLD:
+            #read() keeps reading until end of file, so a file that grew since fstat is still hashed fully
+            hasher.update(f.read())
+        else:
+            if HAS_FADVISE:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            
+            mapped = False
+            #check the size again right before mapping, a file that shrank (or is empty now) uses the read loop
+            if use_mmap and size > MMAP_THRESHOLD and os.fstat(fd).st_size >= size:
+                try:
+                    with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+                        if hasattr(mmap, "MADV_SEQUENTIAL"):
+                            mm.madvise(mmap.MADV_SEQUENTIAL)
+                        hasher.update(mm)
+                    mapped = True
+                except ValueError:
+                    pass    #"cannot mmap an empty file", it was truncated in between
+            
+            if not mapped:
+                buf, view = _get_read_buffer(chunk_size)
+                while True:
+                    n = f.readinto(buf)
+                    if not n:
+                        break
+                    hasher.update(view[:n])
+        
+        stat = os.fstat(fd)
+        if drop_cache and HAS_FADVISE:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    return hasher.digest(), stat
     
 def load_manifest(manifest_path: str) -> dict:
     """
     it reads the existing manifest. If manifest not found it returns the empty dictionary.
+    It uses orjson when it is installed, else the json module.
+    orjson rejects lone surrogates (\udcff), which python uses for file names that are not valid UTF-8,
+    so when orjson fails the json module gets a second try before the manifest is called corrupted.
     """
     if not os.path.exists(manifest_path):
         return {}
@@ -34,111 +199,407 @@ def load_manifest(manifest_path: str) -> dict:
         with open(manifest_path, "r", encoding="utf-8") as f:
             content = f.read().strip()
             
-            if not content:
-                #Empty file -> treat as no manifest
-                return {}           
-            f.seek(0)
-            return json.load(f)
-    except json.JSONDecodeError:
+        if not content:
+            #Empty file -> treat as no manifest
+            return {}
+        if orjson is not None:
+            try:
+                return orjson.loads(content)
+            except orjson.JSONDecodeError:
+                pass
+        return json.loads(content)
+    except json.JSONDecodeError:    #orjson.JSONDecodeError is a subclass of this
         print("Warning: manifest.json is corrupted. Starting with an empty manifest.")
         return {}
         
 def save_manifest(manifest_path: str, manifest_data: dict) -> None:
     """
     It saves the manifest data to json file. It doesnot return anything.
+    It uses orjson when it is installed, else the json module, both with 2 space indent.
+    (json escapes non-ASCII characters like caf\u00e9 and orjson writes them as UTF-8, so the files are not byte-identical.)
+    orjson cannot write lone surrogates (file names that are not valid UTF-8), then the json module is used.
+    The data is written to a .tmp file, flushed to disk (fsync) and then renamed over the manifest,
+    so a crash or power loss while writing never leaves a half written manifest.
+    On POSIX the folder is fsynced too so the rename itself is on disk.
     """
-    with open(manifest_path, "w", encoding="utf-8") as f:
-        json.dump(manifest_data, f, indent=4)
+    #serialize first, so an error here happens before any file is touched
+    data = None
+    if orjson is not None:
+        try:
+            data = orjson.dumps(manifest_data, option=orjson.OPT_INDENT_2)
+        except orjson.JSONEncodeError:
+            pass
+    if data is None:
+        #ensure_ascii (the default) escapes lone surrogates, so the result is plain ASCII
+        data = json.dumps(manifest_data, indent=2).encode("ascii")
+    
+    tmp_path = manifest_path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, manifest_path)
+    except BaseException:
+        #do not leave a half written .tmp file behind
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    
+    #windows cannot open a folder to fsync it
+    if os.name == "posix":
+        dir_fd = os.open(os.path.dirname(manifest_path) or ".", os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
         
+def write_lines(lines: list) -> None:
+    """
+    It writes all collected lines to stdout with one write call and empties the list.
+    """
+    if lines:
+        sys.stdout.write("\n".join(lines) + "\n")
+        lines.clear()
+
 def ensure_directory(path: str) -> None:
     """
     It checks the given path is exists or not. If file/folder is not found it creates new file/folder.
     """
     if not os.path.exists(path):
-        os.makedirs(path)
+        #exist_ok because another worker thread may create the same folder at the same time
+        os.makedirs(path, exist_ok=True)
         
-def backup_file(source_file: str, source_root: str, backup_root: str) -> str:
+def copy_file_fast(source_file: str, destination_file: str, reflink: bool = False) -> bool:
+    """
+    It copies the file data inside the kernel without reading it into python.
+    If reflink is True it first tries a reflink (FICLONE) which is instant on Btrfs/XFS.
+    A reflink shares the disk blocks with the source, so damage to those blocks hits both copies,
+    that is why it is off unless asked for (--reflink). Then it tries os.copy_file_range.
+    It returns False if neither works here or the copy came out short, so the caller can use shutil.copy2 instead.
+    Metadata is not copied.
+    """
+    if not (reflink and fcntl is not None) and not hasattr(os, "copy_file_range"):
+        return False
+    
+    with open(source_file, "rb") as fsrc, open(destination_file, "wb") as fdst:
+        src_fd = fsrc.fileno()
+        dst_fd = fdst.fileno()
+        
+        if reflink and fcntl is not None:
+            try:
+                fcntl.ioctl(dst_fd, FICLONE, src_fd)
+                return True
+            except OSError:
+                pass    #filesystem has no reflinks
+        
+        if hasattr(os, "copy_file_range"):
+            try:
+                copied = 0
+                while True:
+                    n = os.copy_file_range(src_fd, dst_fd, 1 << 30)
+                    if not n:
+                        break
+                    copied += n
+                #some filesystems return 0 right away for a non-empty file, never keep a short copy
+                return copied == os.fstat(src_fd).st_size
+            except OSError:
+                pass    #e.g. old kernel or not supported between these filesystems
+    
+    return False
+
+def backup_file(source_file: str, source_root: str, backup_root: str, reflink: bool = False, rel_path: str | None = None) -> str:
     """
     It copies on file into a backup folder while keeping the same folder strecute as the original source.
+    rel_path is the path of source_file relative to source_root, it is computed when not given.
     """
-    rel_path = os.path.relpath(source_file, source_root)
-    backup_file_path = os.path.join(backup_root, rel_path)
+    if rel_path is None:
+        rel_path = os.path.relpath(source_file, source_root)
+    backup_file_path = os.path.join(backup_root, "") + rel_path
     
     #check the folder is exists or not else create new folder
-    backup_dir = os.path.dirname(backup_file_path)
+    backup_dir = backup_file_path.rsplit(os.sep, 1)[0]
     ensure_directory(backup_dir)
     
-    shutil.copy2(source_file, backup_file_path)   #copy2 preserves the metadata
+    if copy_file_fast(source_file, backup_file_path, reflink):
+        shutil.copystat(source_file, backup_file_path)   #same metadata as copy2
+    else:
+        shutil.copy2(source_file, backup_file_path)   #copy2 preserves the metadata
     return backup_file_path
 
-def scan_and_backup(source_dir: str, backup_dir: str, manifest_path: str) -> None:
+def iter_files(root: str):
+    """
+    It walks the folder with os.scandir and yields (file_path, stat) for every file.
+    scandir already knows which entries are files or folders, so no extra isdir/stat calls are needed for that.
+    Like os.walk it does not go into symlinked folders and skips folders it cannot read.
+    An entry that cannot be checked (deleted while scanning, no permission, symlink loop) is skipped,
+    the rest of its folder and all subfolders are still scanned.
+    It uses a stack instead of recursion so very deep trees do not hit the recursion limit.
+    """
+    stack = [root]
+    while stack:
+        top = stack.pop()
+        try:
+            scandir_it = os.scandir(top)
+        except OSError:
+            continue
+        
+        sub_dirs = []
+        with scandir_it:
+            while True:
+                try:
+                    entry = next(scandir_it)
+                except StopIteration:
+                    break
+                except OSError:
+                    break    #folder could not be read to the end, keep what was found
+                
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        sub_dirs.append(entry.path)
+                        continue
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                yield entry.path, stat
+        
+        #reversed so subfolders are scanned in the order scandir listed them
+        stack.extend(reversed(sub_dirs))
+
+def list_backup_files(backup_dir: str) -> set:
+    """
+    It walks the backup folder once and returns the relative paths of all files in it.
+    Checking a path in this set is much cheaper than calling os.path.exists for every source file.
+    """
+    prefix_len = len(os.path.join(backup_dir, ""))
+    return {
+        (root + os.sep + file_name)[prefix_len:]
+        for root, dirs, files in os.walk(backup_dir)
+        for file_name in files
+    }
+
+def process_file(source_file_path: str, rel_path: str, stat: os.stat_result, source_dir: str, backup_dir: str, previous_entry: dict | None, backup_exists: bool, reflink: bool = False) -> tuple:
+    """
+    It hashes one source file and backs it up if it is new or changed.
+    If size and modification time are same as in the manifest the file is not hashed again.
+    The file is hashed with the algorithm recorded in its manifest entry so old sha256 entries still compare.
+    If it changed and that is not DEFAULT_HASH_ALGO, it is hashed again with DEFAULT_HASH_ALGO for the new entry
+    (a one time move per file from sha256 to blake3).
+    It runs inside the worker threads so it does not touch the manifest.
+    backup_exists tells if the file is already in the backup folder (see list_backup_files).
+    It returns (rel_path, error, file_hash, hash_algo, backup_file_path, size, mtime_ns) and backup_file_path is None when the file was skipped.
+    file_hash is the manifest text of the hash (see encode_hash).
+    If the file cannot be read or copied (deleted or locked since the scan, ...) error is the OSError and the other values are None.
+    """
+    try:
+        hash_algo = DEFAULT_HASH_ALGO
+        if previous_entry is not None:
+            hash_algo = previous_entry.get("hash_algo", LEGACY_HASH_ALGO)
+            if hash_algo not in HASHER_FACTORIES:
+                #e.g. blake3 manifest but blake3 not installed -> hash does not match and file is backed up again
+                hash_algo = DEFAULT_HASH_ALGO
+        
+        if (
+            previous_entry is not None
+            and backup_exists
+            and previous_entry.get("size") == stat.st_size
+            and previous_entry.get("mtime_ns") == stat.st_mtime_ns
+        ):
+            #same size and mtime -> unchanged, reuse the recorded hash
+            return rel_path, None, previous_entry["hash"], hash_algo, None, stat.st_size, stat.st_mtime_ns
+        
+        #a file that will surely be copied keeps its pages cached until the copy has read them
+        will_copy = previous_entry is None or not backup_exists
+        #size and mtime for the manifest come from the hashed file, not from the earlier scan
+        digest, stat = calculate_file_hash_and_stat(source_file_path, algo=hash_algo, drop_cache=not will_copy)
+        file_hash = encode_hash(digest)
+        
+        #compare raw digests so old hex entries match too
+        if will_copy or decode_hash(previous_entry["hash"]) != digest:
+            #New or changed file == backup
+            if hash_algo != DEFAULT_HASH_ALGO:
+                hash_algo = DEFAULT_HASH_ALGO
+                digest, stat = calculate_file_hash_and_stat(source_file_path, algo=hash_algo, drop_cache=False)
+                file_hash = encode_hash(digest)
+            backup_file_path = backup_file(source_file_path, source_dir, backup_dir, reflink, rel_path)
+            drop_page_cache(source_file_path)
+            return rel_path, None, file_hash, hash_algo, backup_file_path, stat.st_size, stat.st_mtime_ns
+        
+        #no change -> skip
+        return rel_path, None, file_hash, hash_algo, None, stat.st_size, stat.st_mtime_ns
+    except OSError as error:
+        return rel_path, error, None, None, None, None, None
+
+def process_batch(batch: list, source_dir: str, backup_dir: str, reflink: bool = False) -> list:
+    """
+    It runs process_file for every (source_file_path, rel_path, stat, previous_entry, backup_exists) item in the batch.
+    One thread pool task per batch keeps the task overhead small when there are many small files.
+    Bigger files are sent as a batch of one (see scan_and_backup).
+    """
+    return [
+        process_file(source_file_path, rel_path, stat, source_dir, backup_dir, previous_entry, backup_exists, reflink)
+        for source_file_path, rel_path, stat, previous_entry, backup_exists in batch
+    ]
+
+def submit_files(executor, source_dir: str, backup_dir: str, manifest: dict, backup_set: set, reflink: bool, max_pending: int):
+    """
+    It walks source_dir, gives the files to the executor (see process_batch) and yields the
+    process_file results in the same order the files were found.
+    At most max_pending tasks are waiting at a time, the oldest is read before more are submitted,
+    so memory does not grow with the number of files and output starts while the walk goes on.
+    """
+    pending = deque()
+    batch = []
+    
+    #paths from iter_files all start with this prefix, slicing it off is cheaper than os.path.relpath
+    source_prefix_len = len(os.path.join(source_dir, ""))
+    
+    for source_file_path, stat in iter_files(source_dir):
+        #ignore the manifest file if it is inside the source directory
+        if source_file_path.rsplit(os.sep, 1)[-1] == MANIFEST_FILE_NAME:
+            continue
+        
+        rel_path = source_file_path[source_prefix_len:]
+        item = (source_file_path, rel_path, stat, manifest.get(rel_path), rel_path in backup_set)
+        if stat.st_size > SMALL_FILE_THRESHOLD:
+            #the small files found before it go first, so results stay in the order the files were found
+            if batch:
+                pending.append(executor.submit(process_batch, batch, source_dir, backup_dir, reflink))
+                batch = []
+            pending.append(executor.submit(process_batch, [item], source_dir, backup_dir, reflink))
+        else:
+            batch.append(item)
+            if len(batch) == HASH_BATCH_SIZE:
+                pending.append(executor.submit(process_batch, batch, source_dir, backup_dir, reflink))
+                batch = []
+        
+        while len(pending) > max_pending:
+            yield from pending.popleft().result()
+    
+    #the last batch can be smaller
+    if batch:
+        pending.append(executor.submit(process_batch, batch, source_dir, backup_dir, reflink))
+    
+    while pending:
+        yield from pending.popleft().result()
+
+def scan_and_backup(source_dir: str, backup_dir: str, manifest_path: str, workers: int = MAX_WORKERS, reflink: bool = False) -> None:
     """
     This function:
         Walks through all files in a given source directory.
-        Checks if each file is:new, or modified since last backup (using a hash comparison).
+        Hashes and copies the files in a pool of workers threads, small files HASH_BATCH_SIZE per task
+        and bigger files one per task (see submit_files and process_batch).
+        Checks if each file is:new, or modified since last backup (using size/mtime first, then a hash comparison).
         If new/modified → backs it up and updates a manifest.
         If unchanged → skips the file.
-        Writes updated backup info to manifest.json.
+        If a file cannot be read or copied → prints [ERROR] and goes on with the other files.
+        Writes updated backup info to manifest.json (only if something changed).
         Prints a summary at the end.
     """
     ensure_directory(backup_dir)
     
+    #the manifest is updated in place, dirty tells if it has to be saved
     manifest = load_manifest(manifest_path)
-    updated_manifest = manifest.copy()
     
     backed_up_files = 0
     skipped_files = 0
+    failed_files = 0
+    #set when any manifest entry is added or changed
+    dirty = False
+    #[BACKUP]/[SKIP]/[ERROR] lines waiting to be printed (see write_lines)
+    log_lines = []
     
     start_time = time.time()
+    #one timestamp for the whole run, used for every file backed up in it
+    run_timestamp = datetime.now().isoformat()
     
-    for root, dirs, files in os.walk(source_dir):
-        for file_name in files:
-            source_file_path = os.path.join(root, file_name)
-            
-            #ignore the manifest file if it is inside the source directory
-            if os.path.basename(source_file_path) == MANIFEST_FILE_NAME:
-                continue
-               
-            file_hash = calculate_file_hash(source_file_path)
-            rel_path = os.path.relpath(source_file_path, source_dir)
-            
-            previous_entry = manifest.get(rel_path)
-            backup_file_path = os.path.join(backup_dir, rel_path)
-            
-            #check if backup file exists
-            backup_exists = os.path.exists(backup_file_path)
-            
-            if previous_entry is None or previous_entry["hash"] != file_hash or not backup_exists:
-                #New or changed file == backup
-                backup_file_path = backup_file(source_file_path, source_dir, backup_dir)
-                updated_manifest[rel_path] = {
+    #files already in the backup folder, read once instead of checking every file
+    backup_set = list_backup_files(backup_dir)
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        #only this thread updates the manifest, in the same order the files were found
+        for rel_path, error, file_hash, hash_algo, backup_file_path, size, mtime_ns in submit_files(
+            executor, source_dir, backup_dir, manifest, backup_set, reflink, workers * PENDING_TASKS_PER_WORKER
+        ):
+            if error is not None:
+                #keep the old manifest entry, the file is tried again next run
+                failed_files += 1
+                log_lines.append(f"[ERROR] {rel_path}: {error}")
+            elif backup_file_path is not None:
+                manifest[rel_path] = {
                     "hash": file_hash,
-                    "last_backup_time": datetime.now().isoformat(), 
+                    "hash_algo": hash_algo,
+                    "last_backup_time": run_timestamp,
                     "backup_path": backup_file_path,
+                    "size": size,
+                    "mtime_ns": mtime_ns,
                 }
+                dirty = True
                 backed_up_files += 1
-                print(f"[BACKUP] {rel_path}")
+                log_lines.append(f"[BACKUP] {rel_path}")
             else:
-                #no change -> skip
+                previous_entry = manifest[rel_path]
+                if previous_entry.get("size") != size or previous_entry.get("mtime_ns") != mtime_ns:
+                    #content is same but stat changed (touched or old manifest), remember the new stat
+                    previous_entry["size"] = size
+                    previous_entry["mtime_ns"] = mtime_ns
+                    dirty = True
                 skipped_files += 1
-                print(f"[SKIP] {rel_path}")
+                log_lines.append(f"[SKIP] {rel_path}")
+            
+            if len(log_lines) >= LOG_BATCH_SIZE:
+                write_lines(log_lines)
+    
+    write_lines(log_lines)
                 
-    save_manifest(manifest_path, updated_manifest)
+    if dirty:
+        save_manifest(manifest_path, manifest)
     
     end_time = time.time()
     print("\n=== Backup Summary ===")
     print(f"Source directory : {source_dir}")
     print(f"Backup directory : {backup_dir}")
-    print(f"Total files scanned : {backed_up_files + skipped_files}")
+    print(f"Total files scanned : {backed_up_files + skipped_files + failed_files}")
     print(f"Files backed up      : {backed_up_files}")
     print(f"Files unchanged      : {skipped_files}")
+    if failed_files:
+        print(f"Files failed         : {failed_files} (see [ERROR] lines, they are tried again next run)")
     print(f"Time taken (seconds) : {end_time - start_time:.2f}")
     
-def verify_backup_integrity(source_dir: str, backup_dir: str, manifest_path: str) -> None:
+def verify_file(backup_dir: str, rel_path: str, expected_hash: str, hash_algo: str, expected_size: int | None) -> tuple:
+    """
+    It checks one backup file against its manifest entry. It runs in the verify worker processes.
+    If the size is different the file is reported as mismatch without hashing it.
+    It returns (rel_path, status) where status is "ok", "missing", "mismatch" or "unsupported".
+    """
+    backup_file_path = os.path.join(backup_dir, rel_path)
+    
+    try:
+        size = os.path.getsize(backup_file_path)
+    except OSError:
+        return rel_path, "missing"
+    
+    if expected_size is not None and size != expected_size:
+        return rel_path, "mismatch"
+    
+    if hash_algo not in HASHER_FACTORIES:
+        return rel_path, "unsupported"
+    
+    #backup files are not written by anything else, so mmap is safe here
+    if calculate_file_hash(backup_file_path, algo=hash_algo, use_mmap=True) != decode_hash(expected_hash):
+        return rel_path, "mismatch"
+    return rel_path, "ok"
+
+def verify_backup_integrity(source_dir: str, backup_dir: str, manifest_path: str, workers: int | None = None) -> None:
     """
     it checks the file in backup folder is still matches the hash value which recoreded in manifest.
     it detects missing files which files present in manifest but not present in backup folder and 
     detects mismatched hashes which files that present in backup folder but file is changed or corrupted.
+    The files are checked in parallel in a pool of workers processes (default: one per cpu, see verify_file).
+    Files bigger than MMAP_THRESHOLD are sent first, biggest first and one per task, so at the end
+    of a large backup the pool is not waiting on one process that still hashes a huge file.
     """
     manifest = load_manifest(manifest_path)
     if not manifest:
@@ -147,36 +608,64 @@ def verify_backup_integrity(source_dir: str, backup_dir: str, manifest_path: str
         
     mismatches = []
     missing_files = []
+    unsupported_files = []
     total_files = len(manifest)
     
-    for rel_path, meta in manifest.items():
-        soruce_file_path = os.path.join(source_dir, rel_path)
-        backup_file_path = os.path.join(backup_dir, rel_path)
-        
-        if not os.path.exists(backup_file_path):
+    #entries from old manifests have no size, they go with the small files
+    large_files = [rel_path for rel_path, meta in manifest.items() if (meta.get("size") or 0) > MMAP_THRESHOLD]
+    large_files.sort(key=lambda rel_path: manifest[rel_path]["size"], reverse=True)
+    large_set = set(large_files)
+    small_files = [rel_path for rel_path in manifest if rel_path not in large_set]
+    
+    def submit(executor, rel_paths, chunksize):
+        entries = [manifest[rel_path] for rel_path in rel_paths]
+        return executor.map(
+            verify_file,
+            repeat(backup_dir),
+            rel_paths,
+            [meta["hash"] for meta in entries],
+            #old manifests have no hash_algo, they were made with sha256
+            [meta.get("hash_algo", LEGACY_HASH_ALGO) for meta in entries],
+            [meta.get("size") for meta in entries],
+            chunksize=chunksize,
+        )
+    
+    statuses = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        #both are submitted before reading any result so the small files fill the pool once the large ones are taken
+        results = chain(
+            submit(executor, large_files, 1),
+            submit(executor, small_files, VERIFY_CHUNK_SIZE),
+        )
+        for rel_path, status in results:
+            statuses[rel_path] = status
+    
+    #report in manifest order
+    for rel_path in manifest:
+        status = statuses[rel_path]
+        if status == "missing":
             missing_files.append(rel_path)
-            continue
-            
-        current_hash = calculate_file_hash(backup_file_path)
-        if current_hash != meta["hash"]:
+        elif status == "mismatch":
             mismatches.append(rel_path)
+        elif status == "unsupported":
+            unsupported_files.append(rel_path)
             
     print("\n=== Integrity Check Report ===")
     print(f"Total files in manifest  : {total_files}")
     print(f"Missing Files            : {len(missing_files)}")
     print(f"Hash Mismatches          : {len(mismatches)}")
+    if unsupported_files:
+        print(f"Not Verified             : {len(unsupported_files)} (hash algorithm not installed, e.g. pip install blake3)")
     
     if missing_files:
         print("\nMissing Files in Backup: ")
-        for i in missing_files:
-            print(f"    :{i}")
+        write_lines([f"    :{i}" for i in missing_files])
         
     if mismatches:
         print(f"Files with hash mismatches (changed files or corrupted files).")
-        for i in mismatches:
-            print(f"    :{i}")
+        write_lines([f"    :{i}" for i in mismatches])
          
-    if not missing_files and not mismatches:
+    if not missing_files and not mismatches and not unsupported_files:
         print("\nAll backed up files passed integrity check.")
         
 def parse_arguments():
@@ -187,6 +676,8 @@ def parse_arguments():
         -where the backup should go
         -whether to run verificarion instead of backup
         -where the manifest file is located
+        -how many workers to use
+        -whether backups may be reflink copies
     it returns the parsed arguments as an objects. (args.source, args.backup ect..)
     """
     parser = argparse.ArgumentParser(
@@ -217,6 +708,19 @@ def parse_arguments():
             help="path to manifest JSON file (default: manifest.json in current directory",
             )
             
+    parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help=f"Number of parallel workers (default: {MAX_WORKERS} threads for backup, one process per CPU for verify).",
+            )
+            
+    parser.add_argument(
+            "--reflink",
+            action="store_true",
+            help="Make copy-on-write copies on Btrfs/XFS (fast, but backup shares disk blocks with the source).",
+            )
+            
     return parser.parse_args()
     
 
@@ -239,10 +743,14 @@ def main():
         print(f"Source directory does not exists: {source_dir}")
         return
         
+    if args.workers is not None and args.workers < 1:
+        print(f"--workers must be at least 1: {args.workers}")
+        return
+        
     if args.verify:
-        verify_backup_integrity(source_dir, backup_dir, manifest_path)
+        verify_backup_integrity(source_dir, backup_dir, manifest_path, args.workers)
     else:
-        scan_and_backup(source_dir,backup_dir,manifest_path)
+        scan_and_backup(source_dir,backup_dir,manifest_path, args.workers or MAX_WORKERS, args.reflink)
         
 
 if __name__ == "__main__":